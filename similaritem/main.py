@@ -1,7 +1,7 @@
+import argparse
+import itertools
 import os
-import os.path
 import random
-import sys
 import time
 
 from similaritem import utils
@@ -10,56 +10,45 @@ random.seed(1786)
 HASH_BUCKETS = utils.L_MAX_32_BIT_INT  # largest 32bit unsigned-integer prime
 
 
-def usage():
-    info = """
-    python similaritem.main [-k shingle-size] [-t threshold] [-sig signature-size] -path
-    Where
-        - path: is a path to a file or directory containing text documents
-        - k   : is the size of the shingles. Defaults to 9
-        - t   : is the threshold for documents signatures, so documents will be considered similar. Defaults to .8
-        - sig : document signature size. Defaults to 100
-    """
+def main(path, shingle_size=9, threshold=.8, signature_size=100, n_jobs=1, signature_method='oph', mode='all-pairs'):
+    files = [entry.path for entry in os.scandir(path) if entry.is_file()]
 
-    print(info)
+    if mode == 'all-pairs':
+        documents_shingles_hashes = hash_shingles_from_files(files, shingle_size, HASH_BUCKETS)
 
+        start = time.time()
+        jaccard_similarities = compare_sets_jaccard(documents_shingles_hashes, n_jobs)
+        end = time.time()
+        jaccard_time = end - start
 
-def main(path, shingle_size=9, threshold=.8, signature_size=100):
-    files = (os.path.join(path, file) for file in os.listdir(path) if os.path.isfile(os.path.join(path, file)))
-    documents_shingles = create_shingles_from_files(files, shingle_size)
-    documents_shingles_hashes = hash_documents_shingles(documents_shingles, HASH_BUCKETS)
+        print('The following jaccard similarities between the k={k} '.format(k=shingle_size) +
+              'k-shingles of all pairs of documents were found in ' +
+              '{duration} seconds:\n'
+              .format(k=shingle_size, duration=end - start) +
+              '\n'.join('{doc_a} \t - {doc_b}: \t {jaccard_sim}'
+                        .format(doc_a=pair[0][0], doc_b=pair[0][1], jaccard_sim=pair[1]) for pair in
+                        jaccard_similarities))
 
     start = time.time()
-    jaccard_similarities = compare_sets_jaccard(documents_shingles_hashes)
-    end = time.time()
-    jaccard_time = end - start
-
-    print('The following jaccard similarities between the k={k} '.format(k=shingle_size) +
-          'k-shingles of all pairs of documents were found in ' +
-          '{duration} seconds:\n'
-          .format(k=shingle_size, duration=end - start) +
-          '\n'.join('{doc_a} \t - {doc_b}: \t {jaccard_sim}'
-                    .format(doc_a=pair[0][0], doc_b=pair[0][1], jaccard_sim=pair[1]) for pair in
-                    jaccard_similarities))
-
-    start = time.time()
-    document_signatures = create_signatures_from_shingles(documents_shingles_hashes, signature_size)
+    document_signatures = create_signatures_from_files(files, shingle_size, signature_size, n_jobs, signature_method)
     end = time.time()
     building_signatures = end - start
 
-    start = time.time()
-    signature_similarities = compare_sets_signature(document_signatures)
-    end = time.time()
-    signatures_time = end - start
-    print('The following similarities of signatures between the '
-          'n={n} sized signatures of all pairs of documents were'.format(n=signature_size) +
-          'found in {duration} seconds:\n'.format(duration=signatures_time) +
-          '\n'.join('{doc_a} \t - {doc_b}: \t {sig_sim}'
-                    .format(doc_a=pair[0][0], doc_b=pair[0][1], sig_sim=pair[1]) for pair in
-                    signature_similarities))
+    if mode == 'all-pairs':
+        start = time.time()
+        signature_similarities = compare_sets_signature(document_signatures, n_jobs)
+        end = time.time()
+        signatures_time = end - start
+        print('The following similarities of signatures between the '
+              'n={n} sized signatures of all pairs of documents were'.format(n=signature_size) +
+              'found in {duration} seconds:\n'.format(duration=signatures_time) +
+              '\n'.join('{doc_a} \t - {doc_b}: \t {sig_sim}'
+                        .format(doc_a=pair[0][0], doc_b=pair[0][1], sig_sim=pair[1]) for pair in
+                        signature_similarities))
 
     n_bands, n_rows = utils.compute_index_measures(signature_size, threshold)
     start = time.time()
-    similar_docs = find_similar_docs_using_lsh(document_signatures, n_rows, n_bands, threshold)
+    similar_docs = find_similar_docs_using_lsh(document_signatures, n_rows, n_bands, threshold, n_jobs)
     end = time.time()
     lsh_time = end - start
     lsh_out = 'Using LSH with a threshold of {t} the following '.format(t=threshold) +\
@@ -73,138 +62,121 @@ def main(path, shingle_size=9, threshold=.8, signature_size=100):
         lsh_out += 'None'
     print(lsh_out)
 
-    print('Summary for times: \n'
-          'Jaccard:\t{jaccard}\n'
-          'Signatures:\t{sig}\n'
-          'LSH:\t\t{lsh}\n'
-          '-------------------------------------\n'
-          'Building Signatures:\t{build_sig_time}'.format(jaccard=jaccard_time, build_sig_time=building_signatures, sig=signatures_time,
-                                   lsh=lsh_time))
+    if mode == 'lsh-only':
+        # only the documents of the pairs found with LSH are hashed and compared
+        start = time.time()
+        similar_pairs = [pair for pair, _ in similar_docs]
+        similar_files = sorted({doc for pair in similar_pairs for doc in pair})
+        documents_shingles_hashes = hash_shingles_from_files(similar_files, shingle_size, HASH_BUCKETS)
+        jaccard_similarities = compare_pairs_jaccard(similar_pairs, documents_shingles_hashes, n_jobs)
+        end = time.time()
+        jaccard_time = end - start
+
+        print('The following jaccard similarities between the k={k} '.format(k=shingle_size) +
+              'k-shingles of the document pairs found with LSH were found in ' +
+              '{duration} seconds:\n'.format(duration=jaccard_time) +
+              '\n'.join('{doc_a} \t - {doc_b}: \t {jaccard_sim}'
+                        .format(doc_a=pair[0][0], doc_b=pair[0][1], jaccard_sim=pair[1]) for pair in
+                        jaccard_similarities))
+
+        print('Summary for times: \n'
+              'Jaccard:\t{jaccard}\n'
+              'LSH:\t\t{lsh}\n'
+              '-------------------------------------\n'
+              'Building Signatures:\t{build_sig_time}'.format(jaccard=jaccard_time, build_sig_time=building_signatures,
+                                                              lsh=lsh_time))
+    else:
+        print('Summary for times: \n'
+              'Jaccard:\t{jaccard}\n'
+              'Signatures:\t{sig}\n'
+              'LSH:\t\t{lsh}\n'
+              '-------------------------------------\n'
+              'Building Signatures:\t{build_sig_time}'.format(jaccard=jaccard_time, build_sig_time=building_signatures,
+                                                              sig=signatures_time, lsh=lsh_time))
 
 
-def hash_documents_shingles(documents, hash_buckets):
+def hash_shingles_from_files(files, shingle_size, hash_buckets):
     document_hashes = dict()
 
-    for k, shingles in documents.items():
-        document_hashes[k] = utils.hash_shingles(shingles, hash_buckets)
+    for file in files:
+        document_hashes[file] = utils.hash_shingles_from_file(file, shingle_size, hash_buckets)
 
     return document_hashes
 
 
-def create_signatures_from_shingles(documents_hashes, signature_size):
-    documents_signatures = {}
-    min_hash_funcs = utils.generate_hash_functions(signature_size, HASH_BUCKETS)
+def create_signatures_from_files(files, shingle_size, signature_size, n_jobs=1, signature_method='oph'):
+    if signature_method == 'minhash':
+        min_hash_funcs = utils.generate_hash_functions(signature_size, HASH_BUCKETS)
 
-    for doc_id, doc_shingle_hashes in documents_hashes.items():
-        documents_signatures[doc_id] = utils.create_min_hash_signature(doc_shingle_hashes, min_hash_funcs)
+        return dict(utils.map_in_chunks(utils.create_min_hash_signatures_from_files, files, n_jobs,
+                                        shingle_size, min_hash_funcs))
 
-    return documents_signatures
+    hash_func = utils.generate_one_permutation_hash(HASH_BUCKETS)
 
+    return dict(utils.map_in_chunks(utils.create_one_permutation_signatures_from_files, files, n_jobs,
+                                    shingle_size, hash_func, signature_size))
 
-def create_shingles_from_files(files, shingle_size):
-    documents = {}
-    for file in files:
-        documents[file] = utils.create_shingles_from_file(file, shingle_size)
-
-    return documents
-
-
-def compare_sets_jaccard(documents_hashes):
-    keys = list(documents_hashes.keys())
-    pairs = []
-    n = len(keys)
 
-    for i in range(n):
-        for j in range(i + 1, n):
-            pairs.append((keys[i], keys[j]))
+def compare_sets_jaccard(documents_hashes, n_jobs=1):
+    pairs = list(itertools.combinations(documents_hashes.keys(), 2))
 
-    jaccard_similarities = []
+    return compare_pairs_jaccard(pairs, documents_hashes, n_jobs)
 
-    for pair in pairs:
-        jaccard_similarities.append(
-            (pair, utils.compute_jaccard_simularity(documents_hashes[pair[0]], documents_hashes[pair[1]])))
 
-    return jaccard_similarities
+def compare_pairs_jaccard(pairs, documents_hashes, n_jobs=1):
+    large_documents_hashes = {doc_id: hashes for doc_id, hashes in documents_hashes.items()
+                              if len(hashes) >= utils.SMALL_SET_SIZE}
+    bitsets = utils.create_shingle_bitsets(large_documents_hashes)
 
+    return utils.map_in_chunks(utils.compute_jaccard_similarities, pairs, n_jobs, documents_hashes, bitsets)
 
-def compare_sets_signature(document_signatures):
-    keys = list(document_signatures.keys())
-    pairs = []
 
-    n = len(keys)
-    for i in range(n):
-        for j in range(i + 1, n):
-            pairs.append((keys[i], keys[j]))
+def compare_sets_signature(document_signatures, n_jobs=1):
+    pairs = list(itertools.combinations(document_signatures.keys(), 2))
 
-    return utils.check_signature_similarity(pairs, document_signatures, 0)
+    return utils.map_in_chunks(utils.check_signature_similarity, pairs, n_jobs, document_signatures, 0)
 
 
-def find_similar_docs_using_lsh(document_signatures, n_rows, n_bands, threshold):
+def find_similar_docs_using_lsh(document_signatures, n_rows, n_bands, threshold, n_jobs=1):
     candidate_pairs = utils.create_lsh_candidate_pairs(document_signatures, n_rows=n_rows, n_bands=n_bands,
                                                        hash_buckets=HASH_BUCKETS)
-    similar_docs = utils.check_signature_similarity(candidate_pairs, document_signatures, threshold)
+    similar_docs = utils.map_in_chunks(utils.check_signature_similarity, list(candidate_pairs), n_jobs,
+                                       document_signatures, threshold)
 
     return similar_docs
 
 
-if __name__ == '__main__':
+def parse_args(args=None):
+    def directory(value):
+        if not os.path.isdir(value):
+            raise argparse.ArgumentTypeError('Path is expected to be a folder with multiple documents')
+        return value
+
+    parser = argparse.ArgumentParser(prog='python -m similaritem.main')
+    parser.add_argument('-path', required=True, type=directory,
+                        help='path to a directory containing text documents')
+    parser.add_argument('-k', dest='shingle_size', type=int, default=9,
+                        help='size of the shingles. Defaults to 9')
+    parser.add_argument('-t', dest='threshold', type=float, default=.8,
+                        help='threshold for documents signatures, so documents will be considered similar. '
+                             'Defaults to .8')
+    parser.add_argument('-sig', dest='signature_size', type=int, default=100,
+                        help='document signature size. Defaults to 100')
+    parser.add_argument('-method', dest='signature_method', choices=('oph', 'minhash'), default='oph',
+                        help='how signatures are built, oph (one permutation minHash) or minhash '
+                             '(one hash function per position). Defaults to oph')
+    parser.add_argument('-mode', choices=('all-pairs', 'lsh-only'), default='all-pairs',
+                        help='all-pairs compares all pairs of documents by jaccard and signature similarity '
+                             'besides running LSH, lsh-only only runs LSH and computes the jaccard similarity '
+                             'of the pairs it finds. Defaults to all-pairs')
+    parser.add_argument('-j', dest='n_jobs', type=int, default=1,
+                        help='number of worker processes building signatures and comparing document pairs, '
+                             '-1 for one per cpu. Defaults to 1')
+
+    return parser.parse_args(args)
+
 
-    argc = len(sys.argv)
-    if argc < 3:
-        usage()
-        sys.exit(1)
-
-    path = None
-    shingle_size = 9
-    threshold = 0.8
-    signature_size = 100
-    path = None
-
-    for i in range(1, argc, 2):
-        if sys.argv[i] == '-k':
-            if argc < i + 1:
-                usage()
-                raise RuntimeError('Missing parameter: -k')
-
-            try:
-                shingle_size = int(sys.argv[i + 1])
-            except ValueError:
-                usage()
-                raise RuntimeError('-k should be an integer')
-
-        elif sys.argv[i] == '-t':
-            if argc < i + 1:
-                usage()
-                raise RuntimeError('Missing parameter: -t')
-            try:
-                threshold = float(sys.argv[i + 1])
-            except ValueError:
-                usage()
-                raise RuntimeError('-t should be a float value')
-
-        elif sys.argv[i] == '-path':
-            if argc < i + 1:
-                usage()
-                raise RuntimeError('Missing parameter: -path')
-
-            path = sys.argv[i + 1]
-
-            if not os.path.isdir(path):
-                usage()
-                raise RuntimeError('Path is expected to be a folder with multiple documents')
-        elif sys.argv[i] == '-sig':
-            if argc < i + 1:
-                usage()
-                raise RuntimeError('Missing parameter: -sig')
-
-            try:
-                signature_size = int(sys.argv[i + 1])
-            except ValueError:
-                usage()
-                raise RuntimeError('-sig should be an integer')
-
-        else:
-            usage()
-            raise RuntimeError('Unknown parameter {}'.format(sys.argv[i]))
-
-    main(path, shingle_size, threshold, signature_size)
+if __name__ == '__main__':
+    args = parse_args()
+    main(args.path, args.shingle_size, args.threshold, args.signature_size, args.n_jobs, args.signature_method,
+         args.mode)
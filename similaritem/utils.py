@@ -1,47 +1,241 @@
-import hashlib
+import array
+import itertools
+import multiprocessing
+import operator
 import random
 import re
-import sys
+import zlib
 
 L_MAX_32_BIT_INT = ((1 << 31) - 1)
+ROLLING_HASH_BASE = 257
+READ_CHUNK_SIZE = 1 << 20  # characters read from a document at once
+SMALL_SET_SIZE = 64  # documents with fewer shingles are compared as sets rather than bitsets
 
+_WHITESPACE = str.maketrans({'\n': ' ', '\t': ' '})
+_MULTISPACE = re.compile('  +')
 
-def create_shingles_from_file(filepath, shingle_size):
-    shingles = set()
+
+def normalize_whitespace(text):
+    """
+    Replaces tabs and new lines with white-space and collapses subsequent white-spaces into one
+    """
+    return _MULTISPACE.sub(' ', text.translate(_WHITESPACE))
+
+
+def read_normalized_chunks(filepath, shingle_size):
+    """
+    Reads a document READ_CHUNK_SIZE characters at a time, with normalised white-space.
+    Every chunk is prefixed with the last shingle_size - 1 characters of the previous one,
+    so shingles spanning two chunks are kept without holding very large documents in memory
+    """
     left_over = ''
     with open(filepath, 'r') as fp:
-        for line in fp:
-            working_line = left_over + line
-            working_line = re.sub('\n', ' ', working_line)
-            working_line = re.sub('\t', ' ', working_line)
-            working_line = re.sub('[ ]{2,}', ' ', working_line)
-            for i in range(len(working_line) - (shingle_size - 1)):
-                shingles.add(working_line[i:i + shingle_size])
-                left_over = working_line[-(shingle_size - 1):]
+        for chunk in iter(lambda: fp.read(READ_CHUNK_SIZE), ''):
+            working_text = normalize_whitespace(left_over + chunk)
+            yield working_text
+            left_over = working_text[max(0, len(working_text) - (shingle_size - 1)):]
+
+
+def hash_shingles_in_chunks(filepath, shingle_size, hash_buckets):
+    """
+    Hashes the shingles of a file without materialising them. A polynomial
+    rolling hash (Rabin-Karp) moves from one shingle to the next in O(1),
+    instead of copying and hashing every shingle on its own
+    :param filepath: path of the document
+    :param shingle_size: number of characters of a shingle
+    :param hash_buckets: prime modulus of the hashes
+    :return: generator of the sets of shingle hashes of each chunk read from the document
+    """
+    base = ROLLING_HASH_BASE
+    leading = pow(base, shingle_size - 1, hash_buckets)  # weight of the character leaving the window
+    for working_text in read_normalized_chunks(filepath, shingle_size):
+        codes = list(map(ord, working_text))
+        if len(codes) < shingle_size:
+            continue
 
-    return shingles
+        hashes = set()
+        h = 0
+        for c in codes[:shingle_size]:
+            h = (h * base + c) % hash_buckets
+        hashes.add(h)
+        for old, new in zip(codes, codes[shingle_size:]):
+            h = ((h - old * leading) * base + new) % hash_buckets
+            hashes.add(h)
 
+        yield hashes
 
-def hash_shingles(shingles, maxi):
-    return {(chash(shingle) & maxi) for shingle in shingles}
+
+def hash_shingles_from_file(filepath, shingle_size, hash_buckets):
+    hashes = set()
+    for chunk_hashes in hash_shingles_in_chunks(filepath, shingle_size, hash_buckets):
+        hashes |= chunk_hashes
+
+    return hashes
 
 
 def create_min_hash_signature(hashed_shingles, hash_funcs):
-    signature = [sys.maxsize for _ in range(len(hash_funcs))]
-    for shingle_hash in hashed_shingles:
-        signature = [min(hfunc(shingle_hash), val) for hfunc, val in zip(hash_funcs, signature)]
+    """
+    Builds the minHash signature of a document
+    :param hashed_shingles: hashes of the shingles of a document
+    :param hash_funcs: (a coefficients, b coefficients, modulus) as returned by generate_hash_functions
+    :return: array with the minimum of each hash function over the shingles,
+             the modulus for documents without shingles
+    """
+    a_coeffs, b_coeffs, p = hash_funcs
+    signature = array.array(signature_typecode(p), [p]) * len(a_coeffs)
+    minhash_kernel(tuple(hashed_shingles), a_coeffs, b_coeffs, p, signature)
+
+    return signature
+
+
+def signature_typecode(hash_buckets):
+    """
+    Smallest unsigned array typecode that holds values up to hash_buckets, i.e. 'I' (uint32)
+    for the default 2^31-1 buckets and 'H' (uint16) for experiments with fewer than 2^16
+    """
+    for typecode in 'HILQ':
+        if hash_buckets < 1 << (8 * array.array(typecode).itemsize):
+            return typecode
+
+    raise ValueError('{} hash buckets do not fit in a machine integer'.format(hash_buckets))
+
 
-    return tuple(signature)
+def create_min_hash_signature_from_file(filepath, shingle_size, hash_funcs):
+    """
+    Builds the minHash signature of a document in the same pass that hashes its shingles,
+    folding the hashes of every chunk into the signature as soon as they are produced,
+    so the shingle hashes of the whole document are never held at once
+    :param filepath: path of the document
+    :param shingle_size: number of characters of a shingle
+    :param hash_funcs: (a coefficients, b coefficients, modulus) as returned by generate_hash_functions
+    :return: array with the minimum of each hash function over the shingles
+    """
+    a_coeffs, b_coeffs, p = hash_funcs
+    signature = array.array(signature_typecode(p), [p]) * len(a_coeffs)
+    for chunk_hashes in hash_shingles_in_chunks(filepath, shingle_size, p):
+        minhash_kernel(tuple(chunk_hashes), a_coeffs, b_coeffs, p, signature)
+
+    return signature
+
+
+def create_min_hash_signatures_from_files(files, shingle_size, hash_funcs):
+    return [(file, create_min_hash_signature_from_file(file, shingle_size, hash_funcs)) for file in files]
+
+
+def minhash_kernel(hashes, a_coeffs, b_coeffs, p, out):
+    """
+    Lowers out[j] to the minimum of (a_coeffs[j] * x + b_coeffs[j]) % p over the hashes.
+    Kept as plain loops over locals without intermediate lists, which is what
+    the PyPy JIT compiles into a tight machine loop
+    """
+    for j in range(len(out)):
+        a, b, m = a_coeffs[j], b_coeffs[j], out[j]
+        for x in hashes:
+            v = (a * x + b) % p
+            if v < m:
+                m = v
+        out[j] = m
 
 
 def generate_hash_functions(n, hash_buckets):
-    hash_funcs = []
+    """
+    Generates n hash functions of the form (a * x + b) % hash_buckets.
+    The coefficients are drawn from the whole domain, with a > 0, so the
+    functions are actual random permutations of the shingle hashes
+    :return: tuple of the a coefficients, the b coefficients and the modulus
+    """
+    a_coeffs, b_coeffs = [], []
     for i in range(n):
-        a = random.randint(1, 100)
-        b = random.randint(1, 100)
-        hash_funcs.append(lambda x, m=a, c=b: (m * x + c) % hash_buckets)
+        a_coeffs.append(random.randint(1, hash_buckets - 1))
+        b_coeffs.append(random.randint(0, hash_buckets - 1))
 
-    return hash_funcs
+    return tuple(a_coeffs), tuple(b_coeffs), hash_buckets
+
+
+def generate_one_permutation_hash(hash_buckets):
+    """
+    Generates the single hash function (a * x + b) % hash_buckets of a one permutation signature
+    :return: tuple of a, b and the modulus
+    """
+    a = random.randint(1, hash_buckets - 1)
+    b = random.randint(0, hash_buckets - 1)
+
+    return a, b, hash_buckets
+
+
+def create_one_permutation_signature(hashed_shingles, hash_func, signature_size):
+    """
+    Builds a one permutation minHash signature of a document. Every shingle is hashed once,
+    the hash picks one of signature_size bins and only the minimum of that bin is kept,
+    so the cost per shingle no longer grows with the signature size. Bins no shingle fell
+    into are filled in by densify_signature
+    :param hashed_shingles: hashes of the shingles of a document
+    :param hash_func: (a, b, modulus) as returned by generate_one_permutation_hash
+    :param signature_size: number of bins of the signature
+    :return: array with the minimum of each bin, the modulus for documents without shingles
+    """
+    a, b, p = hash_func
+    signature = array.array(signature_typecode(p + signature_size), [p]) * signature_size
+    one_permutation_kernel(hashed_shingles, a, b, p, signature)
+    densify_signature(signature, p)
+
+    return signature
+
+
+def create_one_permutation_signature_from_file(filepath, shingle_size, hash_func, signature_size):
+    """
+    Same as create_one_permutation_signature, folding in the shingle hashes of every chunk
+    of the document while they are produced, like create_min_hash_signature_from_file
+    """
+    a, b, p = hash_func
+    signature = array.array(signature_typecode(p + signature_size), [p]) * signature_size
+    for chunk_hashes in hash_shingles_in_chunks(filepath, shingle_size, p):
+        one_permutation_kernel(chunk_hashes, a, b, p, signature)
+    densify_signature(signature, p)
+
+    return signature
+
+
+def create_one_permutation_signatures_from_files(files, shingle_size, hash_func, signature_size):
+    return [(file, create_one_permutation_signature_from_file(file, shingle_size, hash_func, signature_size))
+            for file in files]
+
+
+def one_permutation_kernel(hashes, a, b, p, out):
+    """
+    Lowers out[h % len(out)] to h // len(out) for every h = (a * x + b) % p over the hashes
+    """
+    n_bins = len(out)
+    for x in hashes:
+        value, bin_index = divmod((a * x + b) % p, n_bins)
+        if value < out[bin_index]:
+            out[bin_index] = value
+
+
+def densify_signature(signature, empty):
+    """
+    Fills the bins of a one permutation signature still holding empty with the value of the
+    closest non-empty bin to their right, wrapping around, plus an offset per bin of distance
+    (rotation densification of Shrivastava and Li), so the signatures of two documents still
+    agree in a bin with probability of their jaccard similarity
+    :param signature: one permutation signature, densified in place
+    :param empty: value of bins no shingle fell into, the modulus of the hash function
+    """
+    n_bins = len(signature)
+    offset = (empty - 1) // n_bins + 1  # larger than any value of a non-empty bin
+    filled = [bin_index for bin_index in range(n_bins) if signature[bin_index] != empty]
+    if not filled or len(filled) == n_bins:
+        return
+
+    # walking leftwards from a non-empty bin, the last non-empty bin seen is the closest to the right
+    nearest, distance = signature[filled[0]], 0
+    for step in range(1, n_bins):
+        bin_index = (filled[0] - step) % n_bins
+        if signature[bin_index] == empty:
+            distance += 1
+            signature[bin_index] = nearest + distance * offset
+        else:
+            nearest, distance = signature[bin_index], 0
 
 
 def compute_index_measures(signature_size, threshold, high_recall=True):
@@ -70,34 +264,88 @@ def compute_index_measures(signature_size, threshold, high_recall=True):
 def create_lsh_candidate_pairs(document_signatures, n_rows, n_bands, hash_buckets):
     import collections
 
-    buckets_in_bands = collections.defaultdict(lambda: collections.defaultdict(list))
+    buckets_in_bands = [collections.defaultdict(list) for _ in range(n_bands)]
     for doc_id, signature in document_signatures.items():
-        for band in range(n_bands):
-            bucket = chash(signature[band * n_rows:(band + 1) * n_rows]) & hash_buckets
-            buckets_in_bands[band][bucket].append(doc_id)
-
-    # memory cost
-    # candidates = (candidates for band, bucket in buckets_in_bands.items()
-    #               for k, candidates in bucket.items() if len(candidates) > 1)
+        # crc32 runs over the raw bytes of a band, seeded with the band index
+        if not isinstance(signature, array.array):
+            signature = array.array(signature_typecode(hash_buckets), signature)
+        rows = memoryview(signature).cast('B')
+        span = n_rows * signature.itemsize
+        for band, buckets in enumerate(buckets_in_bands):
+            bucket = zlib.crc32(rows[band * span:(band + 1) * span], band) & hash_buckets
+            buckets[bucket].append(doc_id)
 
     candidate_pairs = set()
 
-    for _, band in buckets_in_bands.items():
-        for _, bucket in band.items():
-
-            n = len(bucket)
-            for i in range(n):
-                for j in range(i + 1, n):
-                    if bucket[i] < bucket[j]:
-                        candidate_pairs.add((bucket[i], bucket[j]))
-                    else:
-                        candidate_pairs.add((bucket[j], bucket[i]))
+    for buckets in buckets_in_bands:
+        for bucket in buckets.values():
+            if len(bucket) > 1:
+                bucket.sort()  # pairs come out ordered
+                candidate_pairs.update(itertools.combinations(bucket, 2))
 
     return candidate_pairs
 
 
 def compute_jaccard_simularity(set1, set2):
-    return float(len(set1.intersection(set2))) / len(set1.union(set2))
+    intersection = len(set1.intersection(set2))
+    return float(intersection) / (len(set1) + len(set2) - intersection)
+
+
+def create_shingle_bitsets(documents_hashes):
+    """
+    Assigns every distinct shingle hash of the documents a bit position and
+    encodes each document as an integer with the bits of its shingles set,
+    so a jaccard similarity is reduced to a bitwise and/or plus popcounts
+    :param documents_hashes: dict of document id to its set of shingle hashes
+    :return: dict of document id to its shingle bitset
+    """
+    positions = {}
+    for hashes in documents_hashes.values():
+        for shingle_hash in hashes:
+            positions.setdefault(shingle_hash, len(positions))
+
+    n_bytes = (len(positions) + 7) // 8
+    bitsets = {}
+    for doc_id, hashes in documents_hashes.items():
+        bits = bytearray(n_bytes)
+        for shingle_hash in hashes:
+            position = positions[shingle_hash]
+            bits[position >> 3] |= 1 << (position & 7)
+        bitsets[doc_id] = int.from_bytes(bytes(bits), 'little')
+
+    return bitsets
+
+
+def compute_jaccard_bitset(bits1, bits2, size1, size2):
+    """
+    Jaccard similarity of two shingle bitsets, given the number of shingles of each,
+    so the union is derived from the intersection instead of being built
+    """
+    intersection = popcount(bits1 & bits2)
+    return float(intersection) / (size1 + size2 - intersection)
+
+
+def compute_jaccard_similarities(pairs, documents_hashes, bitsets):
+    """
+    Jaccard similarities of document pairs. When a document has fewer than SMALL_SET_SIZE
+    shingles the hash sets are intersected, which only iterates the smaller set, otherwise
+    the bitsets are, whose cost grows with the distinct shingles of all documents instead
+    :param pairs: list of document pairs
+    :param documents_hashes: dict of document id to its set of shingle hashes
+    :param bitsets: dict of document id to its shingle bitset, for the documents with
+                    at least SMALL_SET_SIZE shingles
+    :return: list of the pairs with their jaccard similarity
+    """
+    similarities = []
+    for doc_a, doc_b in pairs:
+        hashes_a, hashes_b = documents_hashes[doc_a], documents_hashes[doc_b]
+        if min(len(hashes_a), len(hashes_b)) < SMALL_SET_SIZE:
+            similarity = compute_jaccard_simularity(hashes_a, hashes_b)
+        else:
+            similarity = compute_jaccard_bitset(bitsets[doc_a], bitsets[doc_b], len(hashes_a), len(hashes_b))
+        similarities.append(((doc_a, doc_b), similarity))
+
+    return similarities
 
 
 def check_signature_similarity(candidate_pairs, document_signatures, threshold):
@@ -105,15 +353,37 @@ def check_signature_similarity(candidate_pairs, document_signatures, threshold):
     for candidate_pair in candidate_pairs:
         sig_a = document_signatures[candidate_pair[0]]
         sig_b = document_signatures[candidate_pair[1]]
-        sig_len = len(sig_a)
-        match_count = sum([1 if sig_a[i] == sig_b[i] else 0 for i in range(0, sig_len)])
-        similarity = float(match_count) / sig_len
+        match_count = sum(map(operator.eq, sig_a, sig_b))
+        similarity = float(match_count) / len(sig_a)
         if similarity >= threshold:
             similar_docs.append((candidate_pair, similarity))
 
     return similar_docs
 
 
+def map_in_chunks(func, items, n_jobs, *args):
+    """
+    Applies func(items, *args) to the items split into one chunk per worker process,
+    for work where every item (a document pair, a document) is independent of the others
+    :param func: module level function returning a list of results for a list of items
+    :param items: list of items
+    :param n_jobs: number of worker processes, -1 for one per cpu
+    :return: concatenated results of func, in the order of the items
+    """
+    if n_jobs < 0:
+        n_jobs = multiprocessing.cpu_count()
+
+    if n_jobs <= 1 or len(items) < 2:
+        return func(items, *args)
+
+    chunk_size = -(-len(items) // n_jobs)
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with multiprocessing.Pool(len(chunks)) as pool:
+        results = pool.starmap(func, [(chunk,) + args for chunk in chunks])
+
+    return [result for chunk_results in results for result in chunk_results]
+
+
 def generate_primes(upper_bound):
     """
     Generates prime numbers until an upper-bound
@@ -150,13 +420,12 @@ def generate_primes(upper_bound):
             del vals[i]
 
 
-def chash(value):
+def popcount(value):
     """
-    Consistent hashing of data for strings and numbers
-    :param value: string or numerical value
-    :return:
+    Number of set bits of a non-negative integer
     """
+    return bin(value).count('1')
 
-    val = hashlib.sha256(str(value).encode('utf-8')).hexdigest()
 
-    return int(val, 16) & L_MAX_32_BIT_INT
+if hasattr(int, 'bit_count'):  # python >= 3.10
+    popcount = int.bit_count
@@ -1,23 +1,41 @@
 import os
+import re
 import tempfile
 import unittest
 import uuid
 
 from similaritem import utils
 
+HASH_BUCKETS = (1 << 31) - 1
+
+
+def create_shingles_from_text(text, shingle_size):
+    """
+    Reference shingling the hashed shingles are checked against: the shingles as strings,
+    taken from the whole text at once
+    """
+    text = re.sub('\n', ' ', text)
+    text = re.sub('\t', ' ', text)
+    text = re.sub('[ ]{2,}', ' ', text)
+
+    return {text[i:i + shingle_size] for i in range(len(text) - (shingle_size - 1))}
+
 
 class TestHashing(unittest.TestCase):
     def test_should_hash_shingles(self):
+        text = 'ab bc c d de ef f g gh hi'
 
-        from similaritem import utils
+        filepath = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
 
-        shingles = {'ab', 'bc', 'c ', ' d', 'de', 'ef', 'f ', ' g', 'gh', 'hi'}
+        with open(filepath, 'w') as fp:
+            fp.write(text)
 
         for maxi in ((1 << 31) - 1, (1 << 4) - 1, 4):
-            hashed_shingles = utils.hash_shingles(shingles, maxi)
+            hashed_shingles = utils.hash_shingles_from_file(filepath, 2, maxi)
 
             for shingle_hash in hashed_shingles:
-                self.assertLessEqual(shingle_hash, maxi)
+                self.assertLess(shingle_hash, maxi)
+        os.remove(filepath)
 
 
 class TestShingling(unittest.TestCase):
@@ -29,7 +47,7 @@ class TestShingling(unittest.TestCase):
         with open(filepath, 'w') as fp:
             fp.write(text)
 
-        shingles = utils.create_shingles_from_file(filepath, 2)
+        shingles = utils.hash_shingles_from_file(filepath, 2, HASH_BUCKETS)
 
         self.assertEqual(10, len(shingles))
         os.remove(filepath)
@@ -42,7 +60,7 @@ class TestShingling(unittest.TestCase):
         with open(filepath, 'w') as fp:
             fp.write(text)
 
-        shingles = utils.create_shingles_from_file(filepath, 2)
+        shingles = utils.hash_shingles_from_file(filepath, 2, HASH_BUCKETS)
 
         self.assertEqual(6, len(shingles))
         os.remove(filepath)
@@ -55,7 +73,7 @@ class TestShingling(unittest.TestCase):
         with open(filepath, 'w') as fp:
             fp.write(text)
 
-        shingles = utils.create_shingles_from_file(filepath, 2)
+        shingles = utils.hash_shingles_from_file(filepath, 2, HASH_BUCKETS)
 
         self.assertEqual(6, len(shingles))
         os.remove(filepath)
@@ -68,45 +86,170 @@ class TestShingling(unittest.TestCase):
         with open(filepath, 'w') as fp:
             fp.write(text)
 
-        shingles = utils.create_shingles_from_file(filepath, 2)
+        shingles = utils.hash_shingles_from_file(filepath, 2, HASH_BUCKETS)
 
         self.assertEqual(6, len(shingles))
         os.remove(filepath)
 
+    def test_should_hash_as_many_shingles_as_created_from_multi_line_file(self):
+        text = 'abc def\tghi \n jkl\n\nmno   pqr\n'
+
+        filepath = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
+
+        with open(filepath, 'w') as fp:
+            fp.write(text)
+
+        for shingle_size in (2, 3, 5):
+            shingles = create_shingles_from_text(text, shingle_size)
+            hashed_shingles = utils.hash_shingles_from_file(filepath, shingle_size, HASH_BUCKETS)
+            self.assertEqual(len(shingles), len(hashed_shingles))
+        os.remove(filepath)
+
+    def test_should_keep_shingles_spanning_read_chunks(self):
+        text = 'abc def\tghi \n jkl\n\n\nmno   pqr\nstu\n'
+
+        filepath = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
+
+        with open(filepath, 'w') as fp:
+            fp.write(text)
+
+        read_chunk_size = utils.READ_CHUNK_SIZE
+        try:
+            for shingle_size in (1, 2, 3, 5):
+                utils.READ_CHUNK_SIZE = read_chunk_size
+                shingles = create_shingles_from_text(text, shingle_size)
+                hashed_shingles = utils.hash_shingles_from_file(filepath, shingle_size, HASH_BUCKETS)
+                self.assertEqual(len(shingles), len(hashed_shingles))
+                for chunk_size in (1, 2, 4):
+                    utils.READ_CHUNK_SIZE = chunk_size
+                    self.assertSetEqual(hashed_shingles,
+                                        utils.hash_shingles_from_file(filepath, shingle_size, HASH_BUCKETS))
+        finally:
+            utils.READ_CHUNK_SIZE = read_chunk_size
+            os.remove(filepath)
+
+
+class TestJaccard(unittest.TestCase):
+    def test_should_compute_same_jaccard_similarity_from_bitsets(self):
+        documents_hashes = {'a': {1, 2, 3, 4}, 'b': {3, 4, 5}, 'c': {6}}
+        bitsets = utils.create_shingle_bitsets(documents_hashes)
+
+        for doc_a, doc_b in (('a', 'b'), ('a', 'c'), ('b', 'c'), ('a', 'a')):
+            self.assertAlmostEqual(
+                utils.compute_jaccard_simularity(documents_hashes[doc_a], documents_hashes[doc_b]),
+                utils.compute_jaccard_bitset(bitsets[doc_a], bitsets[doc_b],
+                                             len(documents_hashes[doc_a]), len(documents_hashes[doc_b])))
+
+    def test_should_compute_same_jaccard_similarity_for_small_and_large_documents(self):
+        documents_hashes = {'a': set(range(100)), 'b': set(range(50, 200)), 'c': {1, 2, 3}, 'd': set(range(64))}
+        bitsets = utils.create_shingle_bitsets({'a': documents_hashes['a'], 'b': documents_hashes['b'],
+                                                'd': documents_hashes['d']})
+        pairs = [('a', 'b'), ('a', 'c'), ('a', 'd'), ('b', 'c'), ('b', 'd'), ('c', 'd')]
+
+        for pair, similarity in utils.compute_jaccard_similarities(pairs, documents_hashes, bitsets):
+            self.assertAlmostEqual(
+                utils.compute_jaccard_simularity(documents_hashes[pair[0]], documents_hashes[pair[1]]), similarity)
+
+    def test_should_compare_pairs_the_same_in_worker_processes(self):
+        documents_hashes = {'a': {1, 2, 3, 4}, 'b': {3, 4, 5}, 'c': {6}, 'd': {1, 6}}
+        bitsets = utils.create_shingle_bitsets(documents_hashes)
+        pairs = [('a', 'b'), ('a', 'c'), ('a', 'd'), ('b', 'c'), ('b', 'd'), ('c', 'd')]
+
+        self.assertListEqual(utils.compute_jaccard_similarities(pairs, documents_hashes, bitsets),
+                             utils.map_in_chunks(utils.compute_jaccard_similarities, pairs, 4, documents_hashes,
+                                                 bitsets))
+
 
 class TestSignaturing(unittest.TestCase):
     def test_should_create_different_hash_functions(self):
         hash_buckets = 2147483647
-        hash_functions = utils.generate_hash_functions(10, hash_buckets)
-        hashes = {f(5) for f in hash_functions}
-        self.assertEquals(len(hashes), len(hash_functions))
+        a_coeffs, b_coeffs, p = utils.generate_hash_functions(10, hash_buckets)
+        hashes = {(a * 5 + b) % p for a, b in zip(a_coeffs, b_coeffs)}
+        self.assertEqual(len(hashes), len(a_coeffs))
 
     def test_should_create_signature_from_shingles(self):
-        hash_funcs = [lambda x: (x + 1) % 5, lambda x: (3 * x + 1) % 5]
+        hash_funcs = ((1, 3), (1, 1), 5)
 
         hashed_shingles = [0, 3]
         expected_min_hashing = (1, 0)
         signature = utils.create_min_hash_signature(hashed_shingles, hash_funcs)
         self.assertEqual(2, len(signature))
-        self.assertEqual(expected_min_hashing, signature)
+        self.assertEqual(expected_min_hashing, tuple(signature))
 
         hashed_shingles = [2]
         expected_min_hashing = (3, 2)
         signature = utils.create_min_hash_signature(hashed_shingles, hash_funcs)
         self.assertEqual(2, len(signature))
-        self.assertEqual(expected_min_hashing, signature)
+        self.assertEqual(expected_min_hashing, tuple(signature))
 
         hashed_shingles = [1, 3, 4]
         expected_min_hashing = (0, 0)
         signature = utils.create_min_hash_signature(hashed_shingles, hash_funcs)
         self.assertEqual(2, len(signature))
-        self.assertEqual(expected_min_hashing, signature)
+        self.assertEqual(expected_min_hashing, tuple(signature))
 
         hashed_shingles = [0, 2, 3]
         expected_min_hashing = (1, 0)
         signature = utils.create_min_hash_signature(hashed_shingles, hash_funcs)
         self.assertEqual(2, len(signature))
-        self.assertEqual(expected_min_hashing, signature)
+        self.assertEqual(expected_min_hashing, tuple(signature))
+
+    def test_should_store_signatures_in_narrow_unsigned_arrays(self):
+        hash_funcs = ((1, 3), (1, 1), 5)
+        self.assertEqual('H', utils.create_min_hash_signature([0, 3], hash_funcs).typecode)
+
+        hash_funcs = ((1, 3), (1, 1), (1 << 31) - 1)
+        signature = utils.create_min_hash_signature([], hash_funcs)
+        self.assertGreaterEqual(signature.itemsize, 4)
+        self.assertEqual(((1 << 31) - 1, (1 << 31) - 1), tuple(signature))
+
+    def test_should_create_same_signature_from_file(self):
+        text = 'abc def\tghi \n jkl\n\n\nmno   pqr\nstu\n'
+
+        filepath = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
+
+        with open(filepath, 'w') as fp:
+            fp.write(text)
+
+        hash_buckets = (1 << 31) - 1
+        hash_funcs = utils.generate_hash_functions(10, hash_buckets)
+        hashed_shingles = utils.hash_shingles_from_file(filepath, 3, hash_buckets)
+
+        read_chunk_size = utils.READ_CHUNK_SIZE
+        try:
+            utils.READ_CHUNK_SIZE = 4
+            self.assertEqual(utils.create_min_hash_signature(hashed_shingles, hash_funcs),
+                             utils.create_min_hash_signature_from_file(filepath, 3, hash_funcs))
+        finally:
+            utils.READ_CHUNK_SIZE = read_chunk_size
+            os.remove(filepath)
+
+    def test_should_create_one_permutation_signature_from_shingles(self):
+        hash_func = (1, 0, 16)
+
+        hashed_shingles = [5, 6, 14]  # bins 1, 2 and 2 of four, with values 1, 1 and 3
+        signature = utils.create_one_permutation_signature(hashed_shingles, hash_func, 4)
+        # bins 0 and 3 are empty and take bin 1, one and two bins to the right, shifted by the offset 4
+        self.assertEqual((1 + 4, 1, 1, 1 + 2 * 4), tuple(signature))
+
+        signature = utils.create_one_permutation_signature([], hash_func, 4)
+        self.assertEqual((16, 16, 16, 16), tuple(signature))
+
+    def test_should_create_same_one_permutation_signature_from_file(self):
+        text = 'abc def\tghi \n jkl\n\n\nmno   pqr\nstu\n'
+
+        filepath = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
+
+        with open(filepath, 'w') as fp:
+            fp.write(text)
+
+        hash_buckets = (1 << 31) - 1
+        hash_func = utils.generate_one_permutation_hash(hash_buckets)
+        hashed_shingles = utils.hash_shingles_from_file(filepath, 3, hash_buckets)
+
+        self.assertEqual(utils.create_one_permutation_signature(hashed_shingles, hash_func, 10),
+                         utils.create_one_permutation_signature_from_file(filepath, 3, hash_func, 10))
+        os.remove(filepath)
 
 
 class TestLocalitySensitiveHashing(unittest.TestCase):
@@ -133,6 +276,17 @@ class TestLocalitySensitiveHashing(unittest.TestCase):
         # TODO implement test that ignores order in tuples
         self.assertSetEqual(expected_candidates, candidates)
 
+    def test_should_create_ordered_candidate_pairs_from_shared_buckets(self):
+        hash_buckets = 2147483647
+        n_bands, n_rows = 2, 2
+        document_signatures = {'c': (1, 2, 3, 4),
+                               'a': (1, 2, 5, 6),
+                               'b': (7, 8, 3, 4),
+                               'd': (3, 4, 1, 2)}
+        expected_candidates = {('a', 'c'), ('b', 'c')}
+        candidates = utils.create_lsh_candidate_pairs(document_signatures, n_rows, n_bands, hash_buckets)
+        self.assertSetEqual(expected_candidates, candidates)
+
     def test_should_find_similar_documents_from_candidate_pairs(self):
         threshold = .8
         document_signatures = {'a': (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),